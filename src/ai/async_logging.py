@@ -0,0 +1,151 @@
+"""
+Non-blocking structured logging for the ML API.
+
+Log calls on the request path render the message (``msg % args``) and any
+traceback to plain strings and enqueue the record; JSON encoding and the
+stream write happen on a background QueueListener thread, so a slow stdout or
+log collector never stalls the event loop. Rendering up front pins the values
+as they were at the call and keeps exc_info frames from outliving it. Pass
+values as logging arguments or ``extra`` fields rather than f-strings so
+records dropped by a filter are never rendered at all.
+
+uvicorn's own loggers do not propagate to the root logger by default, so
+configure_async_logging strips their handlers and re-enables propagation;
+access and error lines then take the same queued path.
+
+Per-request INFO logs can be sampled at high QPS with RequestLogSampler.
+WARNING and above always pass, and the queue is unbounded, so error records
+are never dropped.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Loggers uvicorn configures with their own synchronous stream handlers
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a record as one JSON object per line, including ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_text:
+            payload["exc_info"] = record.exc_text
+        elif record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            payload["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(payload, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that renders the message on the caller's thread and leaves JSON encoding to the listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the stock implementation, this does not run the full
+        # formatter here: only the message and traceback become strings, and
+        # the ``extra`` fields stay on the record for JsonFormatter.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _TRACEBACK_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class AsyncLogListener(QueueListener):
+    """QueueListener whose ``stop`` may be called any number of times."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._running = False
+        self._state_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._state_lock:
+            if not self._running:
+                super().start()
+                self._running = True
+
+    def stop(self) -> None:
+        """Flush queued records and stop the listener thread if it is running."""
+        with self._state_lock:
+            if self._running:
+                self._running = False
+                super().stop()
+
+
+class RequestLogSampler(logging.Filter):
+    """Let the first ``burst`` INFO records per second through, then sample at ``rate``."""
+
+    def __init__(self, rate: float = 0.1, burst: int = 50):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._second = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        second = int(time.monotonic())
+        with self._lock:
+            if second != self._second:
+                self._second = second
+                self._count = 0
+            self._count += 1
+            within_burst = self._count <= self.burst
+        return within_burst or random.random() < self.rate
+
+
+def configure_async_logging(level: int = logging.INFO, handler: Optional[logging.Handler] = None) -> AsyncLogListener:
+    """Route root logging through a queue drained by a background JSON writer."""
+    if handler is None:
+        handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = AsyncLogListener(log_queue, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(level)
+
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        for existing in list(uvicorn_logger.handlers):
+            uvicorn_logger.removeHandler(existing)
+        uvicorn_logger.propagate = True
+
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,59 @@
+"""
+Single-flight coalescing of identical in-flight requests.
+
+When several requests with the same key arrive while one computation for
+that key is still running, they all await that computation instead of
+starting their own. Nothing is cached: once the computation finishes, the
+next request with the same key starts a fresh one.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+def coalescing_key(*parts: Any) -> str:
+    """Build a stable key from JSON-serializable parts of a normalized payload."""
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Share one in-flight computation among concurrent callers with the same key."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.requests = 0
+        self.coalesced = 0
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Return the result of ``fn()``, joining a running call for ``key`` if there is one."""
+        self.requests += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        # Shield so that one caller disconnecting does not cancel the
+        # computation the other callers are waiting on
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.openapi.utils import get_openapi
 from typing import Dict, List, Optional
 from pydantic import BaseModel, Field
@@ -9,19 +9,51 @@ import time
 import asyncio
 from datetime import datetime
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+from pathlib import Path
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from coalescing import SingleFlight, coalescing_key
+from async_logging import RequestLogSampler, configure_async_logging
+from profiling import SamplingProfiler, profile_stage, prune_profiles
+from shared_state import InMemoryStateBackend, get_state_backend, incr_with_expiry
+
+# Configure logging. The default "async" mode writes JSON lines from a
+# background thread (see async_logging.py); LOG_MODE=sync restores the plain
+# blocking stream handler.
+ASYNC_LOGGING = os.environ.get("LOG_MODE", "async") == "async"
+if ASYNC_LOGGING:
+    configure_async_logging(level=logging.INFO)
+else:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
 logger = logging.getLogger(__name__)
 
+# Per-request INFO logs are sampled under load; warnings and errors always pass
+request_logger = logging.getLogger(f"{__name__}.requests")
+request_logger.addFilter(RequestLogSampler(
+    rate=float(os.environ.get("LOG_SAMPLE_RATE", "0.1")),
+    burst=int(os.environ.get("LOG_SAMPLE_BURST", "50")),
+))
+
 # API versioning
 API_VERSION = "v1"
 API_PREFIX = f"/api/{API_VERSION}"
 
+# Profiling is opt-in: PROFILING_ENABLED=1 turns on the X-Profile request
+# header and the /profile endpoint, both for API-key holders only. A single
+# request is usually over in a few milliseconds, so it is sampled at the much
+# finer PROFILE_REQUEST_INTERVAL; use /profile to capture a window of traffic.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", "profiles"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.01"))
+PROFILE_REQUEST_INTERVAL = float(os.environ.get("PROFILE_REQUEST_INTERVAL", "0.001"))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "20"))
+MAX_PROFILE_SECONDS = 60
+
 # Initialize FastAPI app
 app = FastAPI(
     title="ML Model API",
@@ -38,26 +70,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Shared state for rate limiting (see shared_state.py). There is no
+# cross-worker cache yet; one would store its entries here as well.
+state_backend = get_state_backend()
+
 # Rate limiting
 class RateLimiter:
-    def __init__(self, requests_per_minute: int = 60):
+    def __init__(self, backend, requests_per_minute: int = 60, key_prefix: str = "ratelimit"):
+        self.backend = backend
         self.requests_per_minute = requests_per_minute
-        self.requests = []
+        self.key_prefix = key_prefix
+        self._last_error_logged = 0.0
+        # Remote backends get their own small pool so limiter checks never queue
+        # behind model inference in the default executor
+        self._executor = None
+        if not isinstance(backend, InMemoryStateBackend):
+            self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rate-limiter")
     
-    def is_allowed(self) -> bool:
-        now = time.time()
-        minute_ago = now - 60
+    async def is_allowed(self) -> bool:
+        # Fixed one-minute window counted in the shared backend so that all
+        # workers draw from the same budget
+        window = int(time.time() // 60)
+        key = f"{self.key_prefix}:{window}"
         
-        # Remove requests older than 1 minute
-        self.requests = [req for req in self.requests if req > minute_ago]
+        try:
+            if self._executor is None:
+                # In-process dict behind a lock; cheaper to call than to hand off
+                count = incr_with_expiry(self.backend, key, 120)
+            else:
+                # Socket round trip to the state server or Redis; keep it off the event loop
+                loop = asyncio.get_running_loop()
+                count = await loop.run_in_executor(self._executor, incr_with_expiry, self.backend, key, 120)
+        except Exception as e:
+            # Fail open: an unreachable backend must not take the API down.
+            # Warn at most every 10 seconds so an outage does not flood the logs.
+            now = time.time()
+            if now - self._last_error_logged >= 10:
+                self._last_error_logged = now
+                logger.warning("Rate limiter backend unavailable, allowing request: %s", e)
+            return True
         
-        if len(self.requests) >= self.requests_per_minute:
-            return False
-        
-        self.requests.append(now)
-        return True
+        return count <= self.requests_per_minute
 
-rate_limiter = RateLimiter()
+rate_limiter = RateLimiter(state_backend)
 
 # Pydantic models for request/response
 class PredictionRequest(BaseModel):
@@ -90,8 +145,19 @@ class MetadataResponse(BaseModel):
     output_shape: List[int] = Field(..., description="Output shape")
     last_updated: str = Field(..., description="Last model update timestamp")
 
+class CoalescingStats(BaseModel):
+    requests: int = Field(..., description="Requests seen by this worker")
+    coalesced: int = Field(..., description="Requests that joined an identical in-flight computation")
+    in_flight: int = Field(..., description="Distinct computations currently running")
+
+class MetricsResponse(BaseModel):
+    worker_pid: int = Field(..., description="Process ID of the worker that served this request")
+    coalescing: Dict[str, CoalescingStats] = Field(..., description="Request coalescing counters per endpoint")
+
 # Mock ML model class (replace with your actual model)
 class MLModel:
+    version = "1.0.0"
+
     @lru_cache(maxsize=1)
     def load_model():
         # Simulate model loading
@@ -107,16 +173,71 @@ class MLModel:
 # Initialize model
 model = MLModel()
 
+# Concurrent identical predictions share one computation
+prediction_flight = SingleFlight("predict")
+
 # Authentication dependency
+def is_valid_api_key(api_key: Optional[str]) -> bool:
+    return api_key == "your-secret-key"  # Replace with secure key management
+
 async def verify_api_key(api_key: str = Header(..., description="API key for authentication")):
-    if api_key != "your-secret-key":  # Replace with secure key management
+    if not is_valid_api_key(api_key):
         raise HTTPException(status_code=401, detail="Invalid API key")
     return api_key
 
+# Only one profiler runs per worker at a time; sampling cost adds up otherwise
+profiling_lock = asyncio.Lock()
+
+# Middleware for per-request profiling. Registered before the rate limiter so
+# the limiter wraps it and rejected requests never reach the profiler. The
+# sampler sees every thread in the worker, so requests served concurrently
+# show up in the stacks as well.
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    if (
+        not PROFILING_ENABLED
+        or request.headers.get("x-profile") != "1"
+        or not is_valid_api_key(request.headers.get("api-key"))
+        or profiling_lock.locked()
+    ):
+        return await call_next(request)
+    
+    async with profiling_lock:
+        profiler = SamplingProfiler(interval=PROFILE_REQUEST_INTERVAL)
+        with profiler:
+            with profiler.stage("request"):
+                response = await call_next(request)
+        
+        # Client errors are not worth a profile and would let callers fill the disk
+        if 400 <= response.status_code < 500:
+            return response
+        
+        # Requests that finish before the first sample only get Server-Timing
+        if profiler.samples:
+            prefix = PROFILE_DIR / f"request_{int(time.time() * 1000)}_{os.getpid()}"
+            loop = asyncio.get_running_loop()
+            # Profile files are a by-product; the request itself already succeeded
+            try:
+                paths = await loop.run_in_executor(None, profiler.save, prefix, f"{request.method} {request.url.path}")
+            except OSError as e:
+                logger.warning("Could not write profile to %s: %s", PROFILE_DIR, e)
+            else:
+                # File name only; the server's directory layout is not the client's business
+                response.headers["X-Profile-File"] = paths[1].name
+            try:
+                await loop.run_in_executor(None, prune_profiles, PROFILE_DIR, PROFILE_MAX_FILES, "request_*")
+            except OSError as e:
+                logger.warning("Could not prune %s: %s", PROFILE_DIR, e)
+    
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={seconds * 1000:.2f}" for name, seconds in profiler.stage_totals().items()
+    )
+    return response
+
 # Middleware for rate limiting
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
-    if not rate_limiter.is_allowed():
+    if not await rate_limiter.is_allowed():
         return JSONResponse(
             status_code=429,
             content={"detail": "Too many requests"}
@@ -132,28 +253,35 @@ async def rate_limit_middleware(request: Request, call_next):
 )
 async def predict(request: PredictionRequest):
     try:
-        logger.info(f"Received prediction request with {len(request.features)} features")
+        request_logger.info("Received prediction request", extra={"feature_count": len(request.features)})
         
         # Input validation
         if not request.features:
             raise HTTPException(status_code=400, detail="No features provided")
         
-        # Make prediction
-        prediction, confidence = model.predict(request.features)
+        # Make prediction, joining an identical one already in flight
+        model_version = request.model_version or model.version
+        features = [float(feature) for feature in request.features]
+        key = coalescing_key(model_version, features)
+        loop = asyncio.get_running_loop()
+        with profile_stage("model.predict"):
+            prediction, confidence = await prediction_flight.do(
+                key, lambda: loop.run_in_executor(None, model.predict, features)
+            )
         
         # Generate response
         response = PredictionResponse(
             prediction=prediction,
             confidence=confidence,
-            model_version="1.0.0",
+            model_version=model.version,
             prediction_id=f"pred_{int(time.time())}"
         )
         
-        logger.info(f"Prediction completed: {response.prediction_id}")
+        request_logger.info("Prediction completed", extra={"prediction_id": response.prediction_id})
         return response
         
     except Exception as e:
-        logger.error(f"Prediction error: {str(e)}")
+        logger.error("Prediction error: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get(
@@ -175,12 +303,49 @@ async def health_check():
 async def get_metadata():
     return MetadataResponse(
         model_name="Example ML Model",
-        model_version="1.0.0",
+        model_version=model.version,
         input_shape=[4],
         output_shape=[1],
         last_updated=datetime.now().isoformat()
     )
 
+@app.get(
+    f"{API_PREFIX}/metrics",
+    response_model=MetricsResponse,
+    dependencies=[Depends(verify_api_key)]
+)
+async def get_metrics():
+    return MetricsResponse(
+        worker_pid=os.getpid(),
+        coalescing={prediction_flight.name: CoalescingStats(**prediction_flight.stats())}
+    )
+
+@app.post(
+    f"{API_PREFIX}/profile",
+    dependencies=[Depends(verify_api_key)]
+)
+async def profile_worker(seconds: float = 10.0, format: str = "speedscope"):
+    """Sample this worker's stacks for a short window and return the profile."""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if format not in ("speedscope", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be 'speedscope' or 'collapsed'")
+    if profiling_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already being captured")
+    
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    async with profiling_lock:
+        profiler = SamplingProfiler(interval=PROFILE_INTERVAL)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+    
+    if format == "collapsed":
+        return PlainTextResponse(profiler.to_collapsed())
+    return JSONResponse(profiler.to_speedscope(f"worker {os.getpid()}"))
+
 # Custom OpenAPI schema
 def custom_openapi():
     if app.openapi_schema:
@@ -208,5 +373,9 @@ def custom_openapi():
 app.openapi = custom_openapi
 
 if __name__ == "__main__":
+    # Single process. Use serve.py for multiple workers: it never imports this
+    # module in the supervisor, so each worker imports it exactly once.
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # This module is imported before uvicorn configures logging here, so in
+    # async mode stop uvicorn from reinstalling its synchronous handlers
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None if ASYNC_LOGGING else uvicorn.config.LOGGING_CONFIG)
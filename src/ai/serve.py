@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Launcher for the ML model API.
+
+Starts uvicorn with one or more worker processes serving ``main:app``. This
+module deliberately does not import ``main``: uvicorn spawns workers, which
+re-run the launcher's ``__main__`` module before importing the app, so any
+import-time side effects here (logging listeners, backend connections)
+would be duplicated in every worker.
+
+Usage:
+  python serve.py --workers 4
+  python serve.py --reload
+"""
+
+import argparse
+import logging
+import os
+
+from shared_state import STATE_BACKEND_URL_ENV, LocalStateServer
+
+APP = "main:app"
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger(__name__)
+
+
+def default_workers() -> int:
+    return int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+
+def run_server(host: str, port: int, workers: int, reload: bool = False) -> None:
+    import uvicorn
+
+    if reload or workers <= 1:
+        # Single process; --reload restarts it on code changes during development
+        uvicorn.run(APP, host=host, port=port, reload=reload, app_dir=APP_DIR)
+        return
+
+    # Workers are separate processes, so unless an external backend (e.g. Redis)
+    # is configured, serve one in-memory store from the supervisor to all of them
+    if STATE_BACKEND_URL_ENV not in os.environ:
+        state_server = LocalStateServer()
+        state_server.start()
+        state_server.export_env()
+        logger.info("Serving shared state at %s", state_server.url)
+
+    # The uvicorn supervisor starts the workers up front, replaces any that die
+    # and restarts them one by one on SIGHUP for a graceful reload
+    uvicorn.run(
+        APP,
+        host=host,
+        port=port,
+        workers=workers,
+        timeout_graceful_shutdown=30,
+        app_dir=APP_DIR,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the ML model API.")
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="Bind address (default: 0.0.0.0).")
+    parser.add_argument("--port", type=int, default=8000, help="Bind port (default: 8000).")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Worker processes (default: $WEB_CONCURRENCY or CPU count).")
+    parser.add_argument("--reload", action="store_true", help="Single process that reloads on code changes (development only).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run_server(args.host, args.port, args.workers, reload=args.reload)
+
+
+if __name__ == "__main__":
+    main()
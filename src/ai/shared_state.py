@@ -0,0 +1,179 @@
+"""
+Shared state backends for the ML API.
+
+Rate-limit counters and caches have to be shared between worker processes,
+otherwise N workers multiply the effective limit by N. Every backend exposes
+the small subset of the redis-py client interface the API relies on
+(``get``, ``set``, ``incr``, ``expire``, ``delete``), so a real Redis client
+can be dropped in unchanged and ``LocalStateServer`` can stand in for Redis
+on a single host. Store str, bytes or int values so every backend behaves
+the same. ``incr_with_expiry`` bundles the increment-and-expire pair used for
+counters into one round trip on either kind of backend.
+
+Select a backend with ``STATE_BACKEND_URL``:
+
+  memory://                  per-process store (default, single worker)
+  local://127.0.0.1:50051    LocalStateServer started by the launcher
+  redis://localhost:6379/0   Redis or any Redis-compatible server
+"""
+
+import os
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+STATE_BACKEND_URL_ENV = "STATE_BACKEND_URL"
+STATE_BACKEND_AUTHKEY_ENV = "STATE_BACKEND_AUTHKEY"
+
+
+class InMemoryStateBackend:
+    """Thread-safe key/value store with per-key expiry and a Redis-like API."""
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _purge_if_expired(self, key: str, now: float) -> None:
+        expires_at = self._expires_at.get(key)
+        if expires_at is not None and expires_at <= now:
+            self._data.pop(key, None)
+            self._expires_at.pop(key, None)
+
+    def get(self, name: str) -> Optional[Any]:
+        """Return the value stored at ``name`` or None."""
+        with self._lock:
+            self._purge_if_expired(name, time.time())
+            return self._data.get(name)
+
+    def set(self, name: str, value: Any, ex: Optional[int] = None, nx: bool = False) -> bool:
+        """Store ``value`` at ``name``, optionally expiring after ``ex`` seconds."""
+        with self._lock:
+            now = time.time()
+            self._purge_if_expired(name, now)
+            if nx and name in self._data:
+                return False
+            self._data[name] = value
+            if ex is not None:
+                self._expires_at[name] = now + ex
+            else:
+                self._expires_at.pop(name, None)
+            return True
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        """Atomically increment the integer at ``name`` and return the new value."""
+        with self._lock:
+            self._purge_if_expired(name, time.time())
+            value = int(self._data.get(name, 0)) + amount
+            self._data[name] = value
+            return value
+
+    def incr_expire(self, name: str, time_: int, amount: int = 1) -> int:
+        """Increment ``name`` and set it to expire after ``time_`` seconds in one call."""
+        with self._lock:
+            now = time.time()
+            self._purge_if_expired(name, now)
+            value = int(self._data.get(name, 0)) + amount
+            self._data[name] = value
+            self._expires_at[name] = now + time_
+            return value
+
+    def expire(self, name: str, time_: int) -> bool:
+        """Expire ``name`` after ``time_`` seconds."""
+        with self._lock:
+            now = time.time()
+            self._purge_if_expired(name, now)
+            if name not in self._data:
+                return False
+            self._expires_at[name] = now + time_
+            return True
+
+    def delete(self, *names: str) -> int:
+        """Delete the given keys and return how many existed."""
+        with self._lock:
+            removed = 0
+            for name in names:
+                if self._data.pop(name, None) is not None:
+                    removed += 1
+                self._expires_at.pop(name, None)
+            return removed
+
+
+class _StateManager(BaseManager):
+    pass
+
+
+class _StateServerManager(BaseManager):
+    pass
+
+
+class LocalStateServer:
+    """Serve one InMemoryStateBackend to every worker over a local socket."""
+
+    def __init__(self, address: Tuple[str, int] = ("127.0.0.1", 0), authkey: Optional[bytes] = None):
+        self.backend = InMemoryStateBackend()
+        self.authkey = authkey or os.urandom(16)
+        _StateServerManager.register("state", callable=lambda: self.backend)
+        self._server = _StateServerManager(address=address, authkey=self.authkey).get_server()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.address
+        return f"local://{host}:{port}"
+
+    def start(self) -> None:
+        """Start serving in a daemon thread of the current process."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def export_env(self) -> None:
+        """Publish the server address so worker processes connect to it."""
+        os.environ[STATE_BACKEND_URL_ENV] = self.url
+        os.environ[STATE_BACKEND_AUTHKEY_ENV] = self.authkey.hex()
+
+
+_StateManager.register("state")
+
+
+def connect_local_state(host: str, port: int, authkey: bytes):
+    """Return a proxy to the backend served by a LocalStateServer."""
+    manager = _StateManager(address=(host, port), authkey=authkey)
+    manager.connect()
+    return manager.state()
+
+
+def incr_with_expiry(backend, name: str, time_: int, amount: int = 1) -> int:
+    """Increment ``name`` and (re)set its expiry in a single round trip."""
+    if hasattr(backend, "pipeline"):
+        # Redis: send both commands in one non-transactional pipeline
+        pipe = backend.pipeline(transaction=False)
+        pipe.incr(name, amount)
+        pipe.expire(name, time_)
+        count, _ = pipe.execute()
+        return int(count)
+    return backend.incr_expire(name, time_, amount)
+
+
+def get_state_backend(url: Optional[str] = None):
+    """Build the shared state backend described by ``url`` or the environment."""
+    url = url or os.environ.get(STATE_BACKEND_URL_ENV, "memory://")
+    parsed = urlparse(url)
+
+    if parsed.scheme == "memory":
+        return InMemoryStateBackend()
+
+    if parsed.scheme == "local":
+        authkey = bytes.fromhex(os.environ.get(STATE_BACKEND_AUTHKEY_ENV, ""))
+        return connect_local_state(parsed.hostname or "127.0.0.1", parsed.port, authkey)
+
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("redis not installed. Install with 'pip install redis' to use a Redis state backend.")
+        return redis.Redis.from_url(url)
+
+    raise ValueError(f"Unsupported state backend URL: {url}")
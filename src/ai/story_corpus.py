@@ -0,0 +1,252 @@
+"""
+Compact columnar storage for the story training corpus.
+
+Instead of one dict per story, StoryCorpus keeps:
+
+  - every story's text in one contiguous UTF-8 buffer, addressed by offsets
+  - sources and titles in two more buffers of the same shape
+  - genres interned to small integer codes
+  - a kind code per story (collected, scraped or genre combination)
+
+StoryRecord is a ``__slots__`` view onto one row, so iterating the corpus
+does not copy it. ``save`` writes the columns to a single file that ``load``
+can memory-map, leaving the operating system to page the text in on demand.
+Columns are stored in the byte order of the machine that wrote them; the
+file records it and ``load`` refuses a file from a host of the other order.
+Call ``close`` (or use the corpus as a context manager) to unmap the file.
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+KIND_COLLECTED = 0
+KIND_SCRAPED = 1
+KIND_COMBINATION = 2
+
+_MAGIC = b"STRYCRP1"
+_HEADER = struct.Struct("<8sQ")  # magic, length of the JSON section table
+_ALIGN = 8
+
+# Column name -> array typecode. Offsets columns hold n + 1 entries.
+_COLUMNS = {
+    "kinds": "B",
+    "genre_codes": "H",
+    "genre_offsets": "Q",
+    "content_offsets": "Q",
+    "source_offsets": "Q",
+    "title_offsets": "Q",
+}
+_BUFFERS = ("content", "source", "title")
+
+
+class StoryRecord:
+    """Read-only view of one story in a StoryCorpus."""
+
+    __slots__ = ("_corpus", "_index")
+
+    def __init__(self, corpus: "StoryCorpus", index: int):
+        self._corpus = corpus
+        self._index = index
+
+    @property
+    def kind(self) -> int:
+        return self._corpus._kinds[self._index]
+
+    @property
+    def genres(self) -> List[str]:
+        corpus, i = self._corpus, self._index
+        codes = corpus._genre_codes[corpus._genre_offsets[i]:corpus._genre_offsets[i + 1]]
+        return [corpus.genres[code] for code in codes]
+
+    @property
+    def genre(self) -> str:
+        corpus, i = self._corpus, self._index
+        return corpus.genres[corpus._genre_codes[corpus._genre_offsets[i]]]
+
+    @property
+    def content_bytes(self) -> memoryview:
+        """UTF-8 encoded content, without copying the underlying buffer."""
+        return self._corpus._slice("content", self._index)
+
+    @property
+    def content(self) -> str:
+        return str(self.content_bytes, "utf-8")
+
+    @property
+    def source(self) -> str:
+        return str(self._corpus._slice("source", self._index), "utf-8")
+
+    @property
+    def title(self) -> str:
+        return str(self._corpus._slice("title", self._index), "utf-8")
+
+    def __getitem__(self, key: str):
+        # Dict-style access for code written against the old list-of-dicts layout
+        if key not in ("genre", "genres", "content", "source", "title"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self) -> str:
+        return f"StoryRecord(index={self._index}, genres={self.genres!r}, source={self.source!r})"
+
+
+class StoryCorpus:
+    """Append-only columnar container of stories, optionally backed by a memory map."""
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self) -> None:
+        """Set every column to an empty, appendable in-memory container."""
+        self.genres: List[str] = []
+        self._genre_index: Dict[str, int] = {}
+        self._kinds = array(_COLUMNS["kinds"])
+        self._genre_codes = array(_COLUMNS["genre_codes"])
+        self._genre_offsets = array(_COLUMNS["genre_offsets"], [0])
+        self._content_offsets = array(_COLUMNS["content_offsets"], [0])
+        self._source_offsets = array(_COLUMNS["source_offsets"], [0])
+        self._title_offsets = array(_COLUMNS["title_offsets"], [0])
+        self._content = bytearray()
+        self._source = bytearray()
+        self._title = bytearray()
+        self._mmap: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+
+    def __len__(self) -> int:
+        return len(self._kinds)
+
+    def __getitem__(self, index: int) -> StoryRecord:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("story index out of range")
+        return StoryRecord(self, index)
+
+    def __iter__(self) -> Iterator[StoryRecord]:
+        for index in range(len(self)):
+            yield StoryRecord(self, index)
+
+    def iter_kind(self, *kinds: int) -> Iterator[StoryRecord]:
+        """Iterate the stories whose kind is one of ``kinds``, in insertion order."""
+        for index, kind in enumerate(self._kinds):
+            if kind in kinds:
+                yield StoryRecord(self, index)
+
+    def intern_genre(self, genre: str) -> int:
+        """Return the code for ``genre``, assigning a new one on first use."""
+        code = self._genre_index.get(genre)
+        if code is None:
+            code = len(self.genres)
+            self.genres.append(genre)
+            self._genre_index[genre] = code
+        return code
+
+    def append(self, kind: int, genres: Sequence[str], content: str, source: str, title: str = "") -> None:
+        """Add one story to the corpus."""
+        if self._mmap is not None:
+            raise ValueError("Cannot append to a memory-mapped corpus.")
+        if not genres:
+            raise ValueError("A story needs at least one genre.")
+        self._kinds.append(kind)
+        self._genre_codes.extend(self.intern_genre(genre) for genre in genres)
+        self._genre_offsets.append(len(self._genre_codes))
+        for name, value in (("content", content), ("source", source), ("title", title)):
+            buffer = getattr(self, f"_{name}")
+            buffer += value.encode("utf-8")
+            getattr(self, f"_{name}_offsets").append(len(buffer))
+
+    def _slice(self, name: str, index: int) -> memoryview:
+        offsets = getattr(self, f"_{name}_offsets")
+        return memoryview(getattr(self, f"_{name}"))[offsets[index]:offsets[index + 1]]
+
+    def nbytes(self) -> int:
+        """Approximate size of the column data in bytes."""
+        total = sum(len(getattr(self, f"_{name}")) for name in _BUFFERS)
+        for name in _COLUMNS:
+            column = memoryview(getattr(self, f"_{name}"))
+            total += column.nbytes
+        return total
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Write the corpus to ``path`` in a layout that ``load`` can memory-map."""
+        sections = [(name, memoryview(getattr(self, f"_{name}")).cast("B")) for name in _COLUMNS]
+        sections += [(name, memoryview(getattr(self, f"_{name}"))) for name in _BUFFERS]
+
+        # The table records where each section starts relative to the data
+        # area, which begins at the first aligned offset after the table
+        table = {"byteorder": sys.byteorder, "genres": self.genres, "sections": {}}
+        position = 0
+        for name, data in sections:
+            table["sections"][name] = [position, data.nbytes]
+            position += _padded(data.nbytes)
+        encoded_table = json.dumps(table).encode("utf-8")
+
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(encoded_table)))
+            f.write(encoded_table)
+            f.write(b"\0" * (_padded(f.tell()) - f.tell()))
+            for _, data in sections:
+                f.write(data)
+                f.write(b"\0" * (_padded(data.nbytes) - data.nbytes))
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "StoryCorpus":
+        """Memory-map a corpus written by ``save``. The result is read-only."""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, table_length = _HEADER.unpack_from(mapped, 0)
+        if magic != _MAGIC:
+            mapped.close()
+            raise ValueError(f"{path} is not a story corpus file.")
+        table = json.loads(mapped[_HEADER.size:_HEADER.size + table_length])
+        if table.get("byteorder") != sys.byteorder:
+            mapped.close()
+            raise ValueError(
+                f"{path} was written on a {table.get('byteorder')}-endian host and cannot be mapped on this {sys.byteorder}-endian one."
+            )
+        data_start = _padded(_HEADER.size + table_length)
+
+        corpus = cls()
+        corpus._mmap = mapped
+        for genre in table["genres"]:
+            corpus.intern_genre(genre)
+        view = corpus._view = memoryview(mapped)
+        for name, (start, length) in table["sections"].items():
+            section = view[data_start + start:data_start + start + length]
+            if name in _COLUMNS:
+                section = section.cast(_COLUMNS[name])
+            setattr(corpus, f"_{name}", section)
+        return corpus
+
+    def close(self) -> None:
+        """Release the memory map of a loaded corpus, leaving it empty.
+
+        Views handed out by StoryRecord.content_bytes must be released first;
+        otherwise the map cannot be closed and BufferError is raised (the
+        corpus is still emptied, and the map is unmapped once those views go).
+        """
+        if self._mmap is None:
+            return
+        mapped = self._mmap
+        try:
+            for name in (*_COLUMNS, *_BUFFERS):
+                getattr(self, f"_{name}").release()
+            self._view.release()
+            mapped.close()
+        finally:
+            self._reset()
+
+    def __enter__(self) -> "StoryCorpus":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _padded(size: int) -> int:
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
@@ -2,6 +2,7 @@
 
 import os
 import glob
+import itertools
 import json
 from pathlib import Path
 import random
@@ -10,7 +11,11 @@ import time
 import requests
 from bs4 import BeautifulSoup
 import re
-from typing import List, Dict, Any
+import textwrap
+from typing import List, Dict, Any, Tuple
+
+from profiling import SamplingProfiler, profile_stage
+from story_corpus import StoryCorpus, StoryRecord, KIND_COLLECTED, KIND_SCRAPED, KIND_COMBINATION
 
 # For potential future Groq API interactions
 try:
@@ -30,8 +35,10 @@ except ImportError:
 class StoryDatasetProcessor:
     def __init__(self, base_dir: str = "datasets"):
         self.base_dir = Path(base_dir)
-        self.stories: List[Dict[str, Any]] = []
-        self.genre_combinations: List[Dict[str, Any]] = []
+        # All collected, scraped and combination stories live in one columnar
+        # corpus; stories, genre_combinations and scraped_stories are read-only
+        # views of it (add stories with self.corpus.append)
+        self.corpus = StoryCorpus()
         self.genre_map = {
             'fantasy': 'Fantasy',
             'sci-fi': 'Sci-Fi',
@@ -42,7 +49,18 @@ class StoryDatasetProcessor:
             'educational': 'Educational',
             'magical-realism': 'Magical-Realism'
         }
-        self.scraped_stories: List[Dict[str, Any]] = []
+
+    @property
+    def stories(self) -> Tuple[StoryRecord, ...]:
+        return tuple(self.corpus.iter_kind(KIND_COLLECTED))
+
+    @property
+    def genre_combinations(self) -> Tuple[StoryRecord, ...]:
+        return tuple(self.corpus.iter_kind(KIND_COMBINATION))
+
+    @property
+    def scraped_stories(self) -> Tuple[StoryRecord, ...]:
+        return tuple(self.corpus.iter_kind(KIND_SCRAPED))
 
     def collect_stories(self) -> None:
         """Collect stories from individual genre folders."""
@@ -54,11 +72,7 @@ class StoryDatasetProcessor:
                 for story_file in story_files:
                     with open(story_file, 'r', encoding='utf-8') as f:
                         content = f.read().strip()
-                    self.stories.append({
-                        "genre": genre,
-                        "content": content,
-                        "source": str(story_file)
-                    })
+                    self.corpus.append(KIND_COLLECTED, [genre], content, str(story_file))
                     print(f"Collected story from {story_file}")
 
     def collect_genre_combinations(self) -> None:
@@ -73,11 +87,7 @@ class StoryDatasetProcessor:
                     for story_file in story_files:
                         with open(story_file, 'r', encoding='utf-8') as f:
                             content = f.read().strip()
-                        self.genre_combinations.append({
-                            "genres": genres,
-                            "content": content,
-                            "source": str(story_file)
-                        })
+                        self.corpus.append(KIND_COMBINATION, genres, content, str(story_file))
                         print(f"Collected combination story from {story_file}")
 
     def scrape_stories(self, max_stories_per_genre: int = 5, delay: float = 2.0) -> None:
@@ -105,12 +115,7 @@ class StoryDatasetProcessor:
                             # Extract a snippet (first 500-1000 words) to keep stories manageable
                             snippet = ' '.join(content.split()[:800])
                             if len(snippet) > 100:  # Ensure it's substantial
-                                self.scraped_stories.append({
-                                    "genre": genre,
-                                    "title": title,
-                                    "content": snippet,
-                                    "source": book_url
-                                })
+                                self.corpus.append(KIND_SCRAPED, [genre], snippet, book_url, title)
                                 # Save to file
                                 existing_files = list(genre_dir.glob("story*.txt"))
                                 next_num = len(existing_files) + 1
@@ -130,25 +135,42 @@ class StoryDatasetProcessor:
 
     def prepare_training_data(self, output_file: str = "training_data.json") -> None:
         """Prepare a JSON file with formatted prompts and responses for training."""
-        training_data = []
-        for story in self.stories + self.scraped_stories:
-            prompt = f"Write a story in the {story['genre']} genre."
-            training_data.append({
-                "prompt": prompt,
-                "response": story['content'],
-                "metadata": {"genre": story['genre'], "source": story['source']}
-            })
-        for combo in self.genre_combinations:
-            genres_str = ' and '.join(combo['genres'])
-            prompt = f"Write a story blending the genres of {genres_str}."
-            training_data.append({
-                "prompt": prompt,
-                "response": combo['content'],
-                "metadata": {"genres": combo['genres'], "source": combo['source']}
-            })
+        count = 0
+        # Entries are written one at a time straight from the corpus rather
+        # than building the whole list in memory first
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(training_data, f, indent=2)
-        print(f"Prepared training data with {len(training_data)} entries, saved to {output_file}")
+            f.write('[')
+            for entry in self._training_entries():
+                f.write(',\n' if count else '\n')
+                f.write(textwrap.indent(json.dumps(entry, indent=2), '  '))
+                count += 1
+            f.write('\n]' if count else ']')
+        print(f"Prepared training data with {count} entries, saved to {output_file}")
+
+    def _training_entries(self):
+        # All collected stories, then all scraped ones, then combinations,
+        # whatever order they were added to the corpus in
+        stories = itertools.chain(self.corpus.iter_kind(KIND_COLLECTED), self.corpus.iter_kind(KIND_SCRAPED))
+        for story in stories:
+            genre = story.genre
+            yield {
+                "prompt": f"Write a story in the {genre} genre.",
+                "response": story.content,
+                "metadata": {"genre": genre, "source": story.source}
+            }
+        for combo in self.corpus.iter_kind(KIND_COMBINATION):
+            genres = combo.genres
+            genres_str = ' and '.join(genres)
+            yield {
+                "prompt": f"Write a story blending the genres of {genres_str}.",
+                "response": combo.content,
+                "metadata": {"genres": genres, "source": combo.source}
+            }
+
+    def save_corpus(self, corpus_file: str = "corpus.bin") -> None:
+        """Save the corpus to a file that StoryCorpus.load can memory-map."""
+        self.corpus.save(corpus_file)
+        print(f"Saved corpus with {len(self.corpus)} stories ({self.corpus.nbytes()} bytes) to {corpus_file}")
 
 class ModelTrainer:
     def __init__(self, data_file: str = "training_data.json", model_name: str = "gpt2"):
@@ -311,27 +333,55 @@ def main():
     parser.add_argument("--epochs", type=int, default=3, help="Number of training epochs (default: 3).")
     parser.add_argument("--prompt", type=str, help="Prompt for inference.")
     parser.add_argument("--max-scrape", type=int, default=5, help="Max stories to scrape per genre (default: 5).")
+    parser.add_argument("--corpus-file", type=str, help="Also save the collected corpus to this memory-mappable file.")
+    parser.add_argument("--profile", type=str, nargs="?", const="profiles/train", metavar="PREFIX", help="Profile the run and write PREFIX.collapsed.txt and PREFIX.speedscope.json (default prefix: profiles/train).")
+    parser.add_argument("--profile-interval", type=float, default=0.01, help="Sampling interval in seconds when profiling (default: 0.01).")
     args = parser.parse_args()
 
+    if not args.profile:
+        run(args)
+        return
+
+    profiler = SamplingProfiler(interval=args.profile_interval)
+    try:
+        with profiler:
+            run(args)
+    finally:
+        # Save even if the run failed or was interrupted; that is when the
+        # profile matters most
+        paths = profiler.save(args.profile, name="train_groq_model")
+        for stage, seconds in profiler.stage_totals().items():
+            print(f"Stage {stage}: {seconds:.3f}s")
+        print(f"Saved profile to {', '.join(str(path) for path in paths)}")
+
+def run(args: argparse.Namespace) -> None:
     # Process dataset
     processor = StoryDatasetProcessor()
-    processor.collect_stories()
-    processor.collect_genre_combinations()
+    with profile_stage("collect"):
+        processor.collect_stories()
+        processor.collect_genre_combinations()
 
     if args.scrape:
         print("Starting web scraping to update datasets...")
-        processor.scrape_stories(max_stories_per_genre=args.max_scrape)
+        with profile_stage("scrape"):
+            processor.scrape_stories(max_stories_per_genre=args.max_scrape)
         print("Web scraping completed.")
 
-    processor.prepare_training_data()
+    with profile_stage("prepare"):
+        processor.prepare_training_data()
+        if args.corpus_file:
+            processor.save_corpus(args.corpus_file)
 
     if args.train:
         try:
             trainer = ModelTrainer(data_file="training_data.json", model_name=args.model)
-            trainer.load_data()
-            trainer.initialize_model()
-            trainer.tokenize_data()
-            trainer.train_model(epochs=args.epochs)
+            with profile_stage("load"):
+                trainer.load_data()
+                trainer.initialize_model()
+            with profile_stage("tokenize"):
+                trainer.tokenize_data()
+            with profile_stage("train"):
+                trainer.train_model(epochs=args.epochs)
         except ImportError as e:
             print(f"Cannot run training: {e}")
             print("Training is a placeholder since Groq does not support direct model training. Use Hugging Face or another platform for actual training.")
@@ -344,7 +394,8 @@ def main():
             prompt = args.prompt if args.prompt else "Write a short story blending the genres of Fantasy and Horror."
             refined_prompt = inferencer.refine_prompt(prompt)
             print(f"Using refined prompt: {refined_prompt}")
-            response = inferencer.generate_response(refined_prompt)
+            with profile_stage("inference"):
+                response = inferencer.generate_response(refined_prompt)
             print("Generated Response:")
             print(response)
             # Extract genre from prompt for saving